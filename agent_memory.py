@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import gc
+import hashlib
+import secrets
 import time
-import uuid
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -17,11 +19,13 @@ class MemoryConfig:
     - max_tokens: rough token estimate threshold before compaction
     - search_top_k: number of history hits to inject when searching
     - summary_max_chars: safety cap to keep summary short
+    - compact_input_tokens: rough token budget for the summarizer's input slice
     """
     max_turns: int = 5
     max_tokens: int = 2500
     search_top_k: int = 5
     summary_max_chars: int = 1400
+    compact_input_tokens: int = 1500
 
 
 @dataclass
@@ -45,8 +49,40 @@ def _rough_tokens(text: str) -> int:
     return max(1, len(text) // 4)
 
 
-def _estimate_tokens(turns: List[Dict[str, Any]]) -> int:
-    return sum(_rough_tokens(t.get("content", "")) for t in turns)
+@dataclass
+class TurnBuffer:
+    """
+    Struct-of-arrays working set. The messages column holds provider-ready
+    {"role", "content"} dicts, built once per turn so build_messages can
+    splice them in without re-allocating; metadata (ts, ids, tokens) stays
+    in parallel lists so hot traversals touch only the column they need.
+    """
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    ts: List[float] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)
+    tokens: List[int] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, role: str, content: str, ts: float, id_: str, tokens: int) -> None:
+        self.messages.append({"role": role, "content": content})
+        self.ts.append(ts)
+        self.ids.append(id_)
+        self.tokens.append(tokens)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        # Dict view only where full dicts are required (archive, summarizer)
+        return [
+            {"role": m["role"], "content": m["content"], "ts": t, "id": i, "tokens": k}
+            for m, t, i, k in zip(self.messages, self.ts, self.ids, self.tokens)
+        ]
+
+    def clear(self) -> None:
+        self.messages.clear()
+        self.ts.clear()
+        self.ids.clear()
+        self.tokens.clear()
 
 
 class AgentMemoryManager:
@@ -76,8 +112,10 @@ class AgentMemoryManager:
         self.summarizer = summarizer
         self.session_id = session_id
 
-        self.active_turns: List[Dict[str, Any]] = []
+        self.active_turns = TurnBuffer()
         self.rolling_summary: str = ""
+        # Running sum of the cached per-turn estimates (O(1) threshold checks)
+        self._active_tokens: int = 0
 
     # --- recording turns ---
     def add_user(self, content: str) -> None:
@@ -87,20 +125,17 @@ class AgentMemoryManager:
         self._add_turn("assistant", content)
 
     def _add_turn(self, role: str, content: str) -> None:
-        self.active_turns.append(
-            {
-                "role": role,
-                "content": content,
-                "ts": time.time(),
-                "id": uuid.uuid4().hex,
-            }
-        )
+        tokens = _rough_tokens(content)
+        # Turn ids are debug handles, not global keys: 8 random bytes is
+        # plenty and skips UUID formatting overhead.
+        self.active_turns.add(role, content, time.time(), secrets.token_hex(8), tokens)
+        self._active_tokens += tokens
 
     # --- compaction policy ---
     def _should_compact(self) -> bool:
         if len(self.active_turns) >= self.cfg.max_turns:
             return True
-        if _estimate_tokens(self.active_turns) >= self.cfg.max_tokens:
+        if self._active_tokens >= self.cfg.max_tokens:
             return True
         return False
 
@@ -108,21 +143,51 @@ class AgentMemoryManager:
         """
         Compaction:
         1) archive current active turns
-        2) update rolling_summary via LLM summarizer (log-style)
+        2) append a summarizer delta block to rolling_summary (log-style)
         3) clear active turns
+
+        Deltas append; older blocks are only evicted from the FRONT when
+        the summary_max_chars cap is hit. The surviving text never gets
+        rewritten, which keeps the prompt prefix stable across compactions.
         """
-        if not self.active_turns:
+        if not len(self.active_turns):
             return
 
-        self.store.append(self.session_id, self.active_turns)
-
-        # Summarize only a recent slice to avoid huge prompts for the summarizer.
-        recent = self.active_turns[-10:] if len(self.active_turns) > 10 else self.active_turns
-        new_summary = self.summarizer.compact(self.rolling_summary, recent)
-
-        # Safety cap
-        self.rolling_summary = (new_summary[: self.cfg.summary_max_chars]).strip()
-        self.active_turns = []
+        turns = self.active_turns.to_dicts()
+        self.store.append(self.session_id, turns)
+
+        # Summarize only a recent slice, chosen by token budget rather
+        # than a fixed turn count: verbose turns shrink the slice, tiny
+        # turns widen it. The newest turn is always included.
+        start = len(turns)
+        budget = self.cfg.compact_input_tokens
+        for tokens in reversed(self.active_turns.tokens):
+            if start < len(turns) and budget - tokens < 0:
+                break
+            budget -= tokens
+            start -= 1
+        recent = turns[start:]
+        delta = self.summarizer.compact(self.rolling_summary, recent).strip()
+
+        combined = (self.rolling_summary + "\n" + delta).strip()
+        if len(combined) > self.cfg.summary_max_chars:
+            combined = combined[-self.cfg.summary_max_chars :]
+            # Drop the partial oldest line left by the cut
+            cut = combined.find("\n")
+            if cut != -1:
+                combined = combined[cut + 1 :]
+        self.rolling_summary = combined
+
+        # Proactively hand the old working set back to the allocator.
+        # Matters for long-lived agent processes: without this, multi-KB
+        # turn contents linger until the GC gets around to them, doubling
+        # peak RSS across a big compaction. (~4 chars/token heuristic.)
+        large = self._active_tokens * 4 > 1_000_000
+        self.active_turns.clear()
+        self._active_tokens = 0
+        del turns, recent
+        if large:
+            gc.collect(0)
 
     # --- prompt build (the only thing that matters at runtime) ---
     def build_messages(
@@ -139,6 +204,11 @@ class AgentMemoryManager:
         history_query:
         - if set, injects top hits from archived transcript
         - injected as "potentially stale" info (hypothesis)
+
+        Message order is provider-cache friendly: deterministic content
+        (system prompt, versioned memory pack, active turns) comes first;
+        volatile history hits ride after the turns as a tool-style user
+        message, so injecting them never invalidates the cached prefix.
         """
         if self._should_compact():
             self._compact()
@@ -149,47 +219,57 @@ class AgentMemoryManager:
                 self.session_id, history_query, top_k=self.cfg.search_top_k
             )
 
-        messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt.strip()}]
+        # Strip once up front; each .strip() below would rescan and
+        # reallocate the full string.
+        sp = system_prompt.strip()
+        rs = self.rolling_summary.strip()
+
+        # Build messages and the token estimate in one pass: each section
+        # adds its tokens as it is emitted, so nothing gets walked twice.
+        messages: List[Dict[str, str]] = [{"role": "system", "content": sp}]
+        token_estimate = _rough_tokens(sp)
 
-        if self.rolling_summary.strip():
+        if rs:
+            # Version tag makes the message text a pure function of the
+            # summary: it only changes when the summary really changes.
+            pack_version = hashlib.blake2b(rs.encode("utf-8"), digest_size=8).hexdigest()
             messages.append(
                 {
                     "role": "system",
-                    "content": "Rolling summary (state):\n" + self.rolling_summary.strip(),
+                    "content": f"# memory-pack {pack_version}\nRolling summary (state):\n" + rs,
                 }
             )
+            token_estimate += _rough_tokens(rs)
 
-        messages.extend({"role": t["role"], "content": t["content"]} for t in self.active_turns)
+        # The buffer's dicts go in as-is — one allocation per turn at
+        # record time, none per build. Callers treat messages as read-only.
+        messages.extend(self.active_turns.messages)
+        token_estimate += self._active_tokens
 
         if history_hits:
-            blob = "\n\n".join(
-                f"[score={h['score']}] {h['turn'].get('role')}: {h['turn'].get('content')}"
-                for h in history_hits
-            )
+            parts = []
+            for h in history_hits:
+                content = h["turn"].get("content", "")
+                parts.append(f"[score={h['score']}] {h['turn'].get('role')}: {content}")
+                # Inlined _rough_tokens: skips a function-call frame per hit
+                token_estimate += len(content) // 4 or 1
             messages.append(
                 {
-                    "role": "system",
+                    "role": "user",
                     "content": (
-                        "Potentially relevant history (treat as stale unless verified):\n"
-                        + blob
+                        "[history search result] Potentially relevant history "
+                        "(treat as stale unless verified):\n" + "\n\n".join(parts)
                     ),
                 }
             )
 
         messages.append({"role": "user", "content": user_message})
-
-        token_estimate = (
-            _rough_tokens(system_prompt)
-            + _rough_tokens(self.rolling_summary)
-            + _estimate_tokens(self.active_turns)
-            + sum(_rough_tokens(h["turn"].get("content", "")) for h in history_hits)
-            + _rough_tokens(user_message)
-        )
+        token_estimate += _rough_tokens(user_message)
 
         ledger = PromptLedger(
             session_id=self.session_id,
             token_estimate=token_estimate,
-            included_summary=bool(self.rolling_summary.strip()),
+            included_summary=bool(rs),
             included_active_turns=len(self.active_turns),
             included_history_hits=len(history_hits),
             notes={
@@ -1,8 +1,145 @@
 from __future__ import annotations
 
+import atexit
 import json
+import mmap
+import os
+import queue
+import re
+import threading
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is the fallback
+    orjson = None
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Coalesced batch size a session writer aims for before issuing a syscall
+_FLUSH_BYTES = 64 * 1024
+
+# How long a session writer waits for more batches to coalesce
+_COALESCE_WINDOW_S = 0.005
+
+# Filler terms that would drag in near-every row on multi-term queries
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for if in is it of on or the to was we what with".split()
+)
+
+
+def _dumps(obj: Any) -> bytes:
+    # orjson emits UTF-8 directly (ensure_ascii=False behavior for free)
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Bump when the on-disk index layout changes; stale indexes get rebuilt.
+_INDEX_VERSION = 1
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class _Trie:
+    """
+    Character trie over index tokens.
+
+    Terminal nodes share the index's posting dicts (token -> {offset: tf}),
+    so appends that update the index are visible here for free. Walking a
+    query costs <= len(query) nodes; the subtree below the last node holds
+    every token the query is a prefix of.
+    """
+
+    __slots__ = ("children", "postings")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Trie"] = {}
+        self.postings: Dict[int, int] = {}
+
+    def insert(self, token: str, postings: Dict[int, int]) -> None:
+        node = self
+        for ch in token:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _Trie()
+            node = child
+        node.postings = postings
+
+    def find(self, prefix: str) -> "_Trie | None":
+        node = self
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def collect(self, scores: Dict[int, int]) -> None:
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for offset, tf in node.postings.items():
+                scores[offset] = scores.get(offset, 0) + tf
+            stack.extend(node.children.values())
+
+
+class _SessionWriter:
+    """
+    Background writer for one session's data + index files.
+
+    append hands serialized batches to the queue and returns immediately;
+    the worker coalesces whatever is queued (plus anything arriving within
+    a short window, up to ~_FLUSH_BYTES) and writes each file in one
+    syscall. Sharding writers by session means one session's compaction
+    never blocks another's. flush() == queue.join(): it returns only once
+    everything handed over is on disk.
+    """
+
+    def __init__(self, path: Path, index_path: Path, index_header: bytes) -> None:
+        self.path = path
+        self.index_path = index_path
+        self.index_header = index_header
+        self.queue: "queue.Queue[Tuple[bytes, bytes]]" = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def flush(self) -> None:
+        self.queue.join()
+
+    def _run(self) -> None:
+        while True:
+            first = self.queue.get()
+            data, log = bytearray(first[0]), bytearray(first[1])
+            count = 1
+            while len(data) < _FLUSH_BYTES:
+                try:
+                    more = self.queue.get(timeout=_COALESCE_WINDOW_S)
+                except queue.Empty:
+                    break
+                data += more[0]
+                log += more[1]
+                count += 1
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, bytes(data))
+            finally:
+                os.close(fd)
+            # Log the index entries only once their offsets exist on disk.
+            if log:
+                if not self.index_path.exists():
+                    self.index_path.write_bytes(self.index_header)
+                with self.index_path.open("ab") as f:
+                    f.write(bytes(log))
+            for _ in range(count):
+                self.queue.task_done()
 
 
 class JsonlHistoryStore:
@@ -11,29 +148,168 @@ class JsonlHistoryStore:
 
     - Archive is NOT injected into the LLM context by default.
     - Archive exists for audit/debug and optional tool-style search.
+    - A per-session inverted index (token -> {byte offset: term frequency})
+      lives beside the JSONL, so search never rescans the whole archive.
     """
 
     def __init__(self, root_dir: str = ".agent_history") -> None:
         self.root = Path(root_dir)
         self.root.mkdir(parents=True, exist_ok=True)
+        # session_id -> {token: {byte offset: tf}}, loaded lazily from disk
+        self._index: Dict[str, Dict[str, Dict[int, int]]] = {}
+        # session_id -> trie over the index tokens (for prefix queries)
+        self._trie: Dict[str, _Trie] = {}
+        # session_id -> background writer owning that session's files
+        self._writers: Dict[str, _SessionWriter] = {}
+        # session_id -> logical archive size (disk + queued bytes)
+        self._sizes: Dict[str, int] = {}
+        atexit.register(self.flush_all)
 
     def _path(self, session_id: str) -> Path:
         return self.root / f"{session_id}.jsonl"
 
-    def append(self, session_id: str, turns: Iterable[Dict[str, Any]]) -> None:
+    def _index_path(self, session_id: str) -> Path:
+        return self.root / f"{session_id}.idx.jsonl"
+
+    # --- index maintenance ---
+    #
+    # The index is maintained strictly incrementally: append tokenizes new
+    # turns and updates the in-memory postings, and flush records one
+    # side-log line per row ({"offset", "len", "tokens"}). Loading replays
+    # the side-log; the main JSONL is only scanned for rows the side-log
+    # does not cover (legacy archives, or a tail lost to a crash between
+    # the data write and the index write).
+
+    def _load_index(self, session_id: str) -> Dict[str, Dict[int, int]]:
+        if session_id in self._index:
+            return self._index[session_id]
+
+        index: Dict[str, Dict[int, int]] = {}
+        covered = 0  # archive bytes the side-log accounts for
+        ip = self._index_path(session_id)
+        if ip.exists():
+            with ip.open("rb") as f:
+                header = _loads(f.readline())
+                if header.get("version") == _INDEX_VERSION:
+                    for line in f:
+                        entry = _loads(line)
+                        offset = entry["offset"]
+                        for token, tf in entry["tokens"].items():
+                            postings = index.setdefault(token, {})
+                            postings[offset] = postings.get(offset, 0) + tf
+                        covered = offset + entry["len"]
+                else:
+                    # Stale schema: drop it and reindex from the archive.
+                    index, covered = {}, 0
+                    ip.unlink()
+
         p = self._path(session_id)
-        with p.open("a", encoding="utf-8") as f:
-            for t in turns:
-                f.write(json.dumps(t, ensure_ascii=False) + "\n")
+        size = p.stat().st_size if p.exists() else 0
+        if size > covered:
+            self._index_tail(session_id, index, covered)
+
+        self._index[session_id] = index
+        trie = self._trie[session_id] = _Trie()
+        for token, postings in index.items():
+            trie.insert(token, postings)
+        return index
+
+    def _index_tail(self, session_id: str, index: Dict[str, Dict[int, int]], start: int) -> None:
+        """Index archive rows the side-log is missing and log them."""
+        log = bytearray()
+        with self._path(session_id).open("rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                tokens: Dict[str, int] = {}
+                for token in _tokenize(_loads(line).get("content") or ""):
+                    tokens[token] = tokens.get(token, 0) + 1
+                    postings = index.setdefault(token, {})
+                    postings[offset] = postings.get(offset, 0) + 1
+                log += _dumps({"offset": offset, "len": len(line), "tokens": tokens}) + b"\n"
+                offset += len(line)
+        ip = self._index_path(session_id)
+        if not ip.exists():
+            ip.write_bytes(_dumps({"version": _INDEX_VERSION}) + b"\n")
+        with ip.open("ab") as f:
+            f.write(bytes(log))
+
+    def _writer(self, session_id: str) -> _SessionWriter:
+        writer = self._writers.get(session_id)
+        if writer is None:
+            p = self._path(session_id)
+            self._sizes[session_id] = p.stat().st_size if p.exists() else 0
+            writer = self._writers[session_id] = _SessionWriter(
+                p,
+                self._index_path(session_id),
+                _dumps({"version": _INDEX_VERSION}) + b"\n",
+            )
+        return writer
+
+    # --- archive ---
+    def append(self, session_id: str, turns: Iterable[Dict[str, Any]]) -> None:
+        """
+        Serializes the batch and hands it to the session's background
+        writer; the call never blocks on disk. Reads flush first, so
+        read-your-writes still holds.
+        """
+        index = self._load_index(session_id)
+        trie = self._trie[session_id]
+        writer = self._writer(session_id)
+        offset = self._sizes[session_id]
+        data = bytearray()
+        log = bytearray()
+        for t in turns:
+            line = _dumps(t) + b"\n"
+            data += line
+            tokens: Dict[str, int] = {}
+            for token in _tokenize(t.get("content") or ""):
+                tokens[token] = tokens.get(token, 0) + 1
+                postings = index.get(token)
+                if postings is None:
+                    postings = index[token] = {}
+                    trie.insert(token, postings)
+                postings[offset] = postings.get(offset, 0) + 1
+            log += _dumps({"offset": offset, "len": len(line), "tokens": tokens}) + b"\n"
+            offset += len(line)
+        self._sizes[session_id] = offset
+        writer.queue.put((bytes(data), bytes(log)))
+
+    def flush(self, session_id: str) -> None:
+        """Blocks until everything queued for the session is on disk."""
+        writer = self._writers.get(session_id)
+        if writer is not None:
+            writer.flush()
+
+    def flush_all(self) -> None:
+        for session_id in list(self._writers):
+            self.flush(session_id)
 
     def read_all(self, session_id: str) -> List[Dict[str, Any]]:
+        self.flush(session_id)
         p = self._path(session_id)
         if not p.exists():
             return []
         rows: List[Dict[str, Any]] = []
-        with p.open("r", encoding="utf-8") as f:
+        with p.open("rb") as f:
             for line in f:
-                rows.append(json.loads(line))
+                rows.append(_loads(line))
+        return rows
+
+    def _load_rows(self, session_id: str, offsets: List[int]) -> List[Dict[str, Any]]:
+        # One shared mapping, then slice-and-parse per winning row: no
+        # seek/read syscall pair per offset, and only hit rows get parsed.
+        rows: List[Dict[str, Any]] = []
+        with self._path(session_id).open("rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in offsets:
+                    end = mm.find(b"\n", offset)
+                    if end == -1:
+                        end = len(mm)
+                    rows.append(_loads(mm[offset:end]))
+            finally:
+                mm.close()
         return rows
 
     def keyword_search(self, session_id: str, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
@@ -44,17 +320,38 @@ class JsonlHistoryStore:
         - Zero dependencies
         - Easy to reason about
         - Keeps focus on memory discipline, not retrieval magic
+
+        Served from the inverted index: only posting-list hits get scored,
+        and only the winning rows get deserialized. Query terms match as
+        prefixes via the trie ("retu" hits "return", "returned").
+
+        Matching is case-insensitive: content is lowercased exactly once,
+        at index time, never per query. Multi-term queries cost one
+        posting-list walk per term; stop words are dropped unless the
+        query is nothing but stop words.
         """
-        q = (query or "").strip().lower()
-        if not q:
+        tokens = _tokenize(query or "")
+        meaningful = [t for t in tokens if t not in _STOPWORDS]
+        if meaningful:
+            tokens = meaningful
+        if not tokens:
             return []
 
-        hits: List[Dict[str, Any]] = []
-        for row in self.read_all(session_id):
-            content = (row.get("content") or "")
-            score = content.lower().count(q)
-            if score > 0:
-                hits.append({"score": float(score), "turn": row})
+        self.flush(session_id)
+        self._load_index(session_id)
+        trie = self._trie[session_id]
+        scores: Dict[int, int] = {}
+        for token in tokens:
+            node = trie.find(token)
+            if node is not None:
+                node.collect(scores)
+
+        if not scores:
+            return []
 
-        hits.sort(key=lambda x: x["score"], reverse=True)
-        return hits[:top_k]
+        top = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+        rows = self._load_rows(session_id, [offset for offset, _ in top])
+        return [
+            {"score": float(score), "turn": row}
+            for (_, score), row in zip(top, rows)
+        ]
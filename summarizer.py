@@ -1,7 +1,21 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Callable, Dict, List
+import hashlib
+import json
+import math
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(x * x for x in b))
+    if na == 0.0 or nb == 0.0:
+        return 0.0
+    return dot / (na * nb)
 
 
 @dataclass
@@ -12,45 +26,109 @@ class LlmSummarizer:
     You provide:
       llm_client(system_prompt: str, user_prompt: str) -> str
 
-    The summarizer produces a rolling state summary that behaves like logging:
-    - goal / constraints
+    The summarizer emits a timestamped DELTA block per compaction (what
+    changed since the last one), not a rewritten summary. The caller
+    appends deltas to its rolling log, so the older text stays
+    byte-stable and provider prompt caches keep hitting. Each delta
+    covers:
     - key facts
     - decisions
-    - what was tried
     - failures
     - next step
+
+    Caching (skips the LLM call entirely on a hit):
+    - exact tier: keyed on (previous_summary, transcript) hash; handy for
+      retries, replays, and tests
+    - semantic tier (optional): supply embed_fn(text) -> vector and
+      near-duplicate transcripts (cosine >= semantic_threshold) reuse the
+      cached delta
+    - set cache_path to persist the exact tier across runs (JSONL)
     """
     llm_client: Callable[[str, str], str]
+    cache_path: Optional[str] = None
+    embed_fn: Optional[Callable[[str], List[float]]] = None
+    semantic_threshold: float = 0.97
+
+    _cache: Dict[str, str] = field(default_factory=dict, init=False, repr=False)
+    _embeddings: List[Tuple[List[float], str]] = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.cache_path and Path(self.cache_path).exists():
+            with Path(self.cache_path).open("r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._cache[entry["key"]] = entry["delta"]
+
+    def _remember(self, key: str, transcript: str, delta: str) -> None:
+        self._cache[key] = delta
+        if self.embed_fn is not None:
+            self._embeddings.append((self.embed_fn(transcript), delta))
+        if self.cache_path:
+            with Path(self.cache_path).open("a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "delta": delta}, ensure_ascii=False) + "\n")
+
+    def _lookup(self, key: str, transcript: str) -> Optional[str]:
+        hit = self._cache.get(key)
+        if hit is not None:
+            return hit
+        if self.embed_fn is not None and self._embeddings:
+            vec = self.embed_fn(transcript)
+            best, best_delta = 0.0, None
+            for other, delta in self._embeddings:
+                score = _cosine(vec, other)
+                if score > best:
+                    best, best_delta = score, delta
+            if best >= self.semantic_threshold:
+                return best_delta
+        return None
 
     def compact(self, previous_summary: str, recent_turns: List[Dict[str, str]]) -> str:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
         system_prompt = (
-            "You summarize agent conversations into a compact state log.\n"
+            "You extend an agent conversation state log.\n"
             "Rules:\n"
+            "- Output ONLY a delta section covering the recent turns.\n"
+            "- Do NOT rewrite or repeat the previous state log.\n"
             "- Keep only stable facts, decisions, failures, and next steps.\n"
             "- Do NOT include fluff.\n"
-            "- Do NOT copy the whole transcript.\n"
             "- Write in plain text.\n"
             "- Output format:\n"
-            "  Goal:\n"
-            "  Key facts:\n"
+            f"  [delta {ts}]\n"
+            "  Facts:\n"
             "  Decisions:\n"
-            "  What we tried:\n"
             "  Failures / risks:\n"
             "  Next step:\n"
         )
 
-        transcript = "\n".join(
-            f"{t.get('role')}: {t.get('content', '').strip()}"
-            for t in recent_turns
-            if t.get("role") in ("user", "assistant") and (t.get("content") or "").strip()
-        )
+        # Strip each content once; the filter-and-format generator used to
+        # strip twice per turn.
+        parts: List[str] = []
+        for t in recent_turns:
+            role = t.get("role")
+            if role not in ("user", "assistant"):
+                continue
+            content = (t.get("content") or "").strip()
+            if content:
+                parts.append(f"{role}: {content}")
+        transcript = "\n".join(parts)
+
+        # Key on what the summarizer is actually reacting to, not the
+        # system prompt (whose timestamp changes every call).
+        key = hashlib.blake2b(
+            (previous_summary + "\x00" + transcript).encode("utf-8")
+        ).hexdigest()
+        cached = self._lookup(key, transcript)
+        if cached is not None:
+            return cached
 
         user_prompt = (
-            "Previous state summary (may be empty):\n"
+            "Previous state log (context only, do not repeat it):\n"
             f"{previous_summary.strip()}\n\n"
             "Recent turns:\n"
             f"{transcript}\n\n"
-            "Update the state summary now."
+            "Write the delta section now."
         )
 
-        return self.llm_client(system_prompt, user_prompt).strip()
+        delta = self.llm_client(system_prompt, user_prompt).strip()
+        self._remember(key, transcript, delta)
+        return delta